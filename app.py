@@ -1,24 +1,68 @@
 import os
+import re
+import orjson # Fast JSON for tool call arguments and tool outputs
+import asyncio
+import random
 import time
-import json # Added for tool call argument parsing
-import requests # Added for SimilarWeb API calls
-from openai import OpenAI
+import logging
+import hashlib
+from typing import Literal
+import httpx # Added for SimilarWeb API calls
+import numpy as np
+from cachetools import TTLCache
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from prompt_toolkit import PromptSession
+from prompt_toolkit.history import FileHistory
+from openai import AsyncOpenAI, AsyncAssistantEventHandler
+from typing_extensions import override
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize OpenAI client
 # It's good practice to handle the case where the API key might be missing.
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY not found in environment variables. Please set it in the .env file.")
-client = OpenAI(api_key=api_key)
+client = AsyncOpenAI(api_key=api_key)
 
 # SimilarWeb API Key
 similarweb_api_key = os.getenv("SIMILARWEB_API_KEY")
 if not similarweb_api_key:
-    print("Warning: SIMILARWEB_API_KEY not found. Keyword functionality will be disabled.")
+    logger.warning("SIMILARWEB_API_KEY not found. Keyword functionality will be disabled.")
+
+# Shared HTTP client for SimilarWeb so connections (and their TLS handshakes) are reused across tool calls.
+# The transport retries failed connection attempts; HTTP-level retries are handled in _similarweb_get.
+# Idle connections are kept for SIMILARWEB_KEEPALIVE_EXPIRY rather than httpx's default 5s, which
+# would close them between REPL turns while the user types and the model runs.
+SIMILARWEB_KEEPALIVE_EXPIRY = 300 # Seconds
+similarweb_last_used = None # time.monotonic() of the last request, to tell whether the pool is still warm
+similarweb_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(27, connect=3.05),
+    transport=httpx.AsyncHTTPTransport(
+        retries=3,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10,
+                            keepalive_expiry=SIMILARWEB_KEEPALIVE_EXPIRY)
+    )
+)
+SIMILARWEB_TOP_KEYWORDS_URL = "https://api.similarweb.com/v4/shopper/category-top-keywords"
+# Query parameters shared by every call, built once; per-call parameters are appended as pairs.
+SIMILARWEB_BASE_PARAMS = (("api_key", similarweb_api_key), ("format", "json"))
+SIMILARWEB_MAX_RETRIES = 3
+SIMILARWEB_RETRY_BACKOFF = 0.4 # Seconds; doubled on each retry
+SIMILARWEB_RETRY_BACKOFF_CAP = 4.0
+SIMILARWEB_RETRY_STATUSES = {429, 500, 502, 503, 504}
+SIMILARWEB_MAX_RESPONSE_BYTES = 2 * 1024 * 1024 # Keyword responses are normally tens of KB
+
+# Per-keyword fields passed back to the assistant; the rest of the payload only inflates the next prompt.
+SIMILARWEB_KEYWORD_FIELDS = ("keyword", "volume", "clicks", "share", "date")
+
+# SimilarWeb data for a given query changes at most monthly, so cache serialized responses for a day.
+similarweb_cache = TTLCache(maxsize=512, ttl=86400)
+similarweb_cache_stats = {"hits": 0, "misses": 0}
 
 # --- Tool Definition for OpenAI Assistant ---
 
@@ -53,7 +97,9 @@ similarweb_tool_definition = {
                 },
                 "limit": {
                     "type": "integer",
-                    "description": "The maximum number of keywords to return. Defaults to 10."
+                    "minimum": 1,
+                    "maximum": 100,
+                    "description": "The maximum number of keywords to return, from 1 to 100. Defaults to 10."
                 }
             },
             "required": ["category", "domain", "start_date", "end_date"]
@@ -61,200 +107,373 @@ similarweb_tool_definition = {
     }
 }
 
+class SimilarWebArgs(BaseModel):
+    """Validated arguments for get_similarweb_top_keywords, mirroring similarweb_tool_definition."""
+    # Required strings must be non-empty; numeric category IDs (e.g. -1) are accepted as strings
+    model_config = ConfigDict(str_strip_whitespace=True, str_min_length=1, coerce_numbers_to_str=True)
+
+    category: str
+    domain: str
+    start_date: str
+    end_date: str
+    granularity: Literal["Daily", "Weekly", "Monthly"] = "Monthly"
+    limit: int = Field(10, ge=1, le=100)
+
+def _tool_signature(tool):
+    """Serializes the parts of a tool definition we control, so local and server copies compare equal."""
+    function = tool.get("function", {})
+    return orjson.dumps({
+        "type": tool.get("type"),
+        "name": function.get("name"),
+        "description": function.get("description"),
+        "parameters": function.get("parameters")
+    }, option=orjson.OPT_SORT_KEYS)
+
+# Serialized once at import; both the check against the assistant's tools and the
+# hash recorded in the local assistant cache are derived from this same artifact.
+SIMILARWEB_TOOL_BYTES = _tool_signature(similarweb_tool_definition)
+SIMILARWEB_TOOL_HASH = hashlib.sha1(SIMILARWEB_TOOL_BYTES).hexdigest()
+
+# Input history for the REPL, shared across sessions.
+HISTORY_FILE = os.path.expanduser("~/.openai_assistant_history")
+
+# Records which tool definition each assistant was last synced with. Delete it to force a re-check.
+ASSISTANT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".assistant_cache.json")
+
 # --- Function Definitions for Assistant Tools ---
 
-def get_similarweb_top_keywords(category: str, domain: str, start_date: str, end_date: str, granularity: str = "Monthly", limit: int = 10):
-    """Fetches top keywords from SimilarWeb API for a given category, domain, and date range."""
+def _backoff_delay(attempt):
+    """Exponential backoff with +/-30% jitter, so concurrent retries don't fire in lockstep."""
+    return min(SIMILARWEB_RETRY_BACKOFF_CAP, SIMILARWEB_RETRY_BACKOFF * (2 ** attempt)) * random.uniform(0.7, 1.3)
+
+class SimilarWebResponseTooLarge(Exception):
+    """Raised when a SimilarWeb response body exceeds SIMILARWEB_MAX_RESPONSE_BYTES."""
+
+async def _read_capped(response):
+    """Reads a streamed response body, giving up as soon as it grows past SIMILARWEB_MAX_RESPONSE_BYTES."""
+    content_length = response.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > SIMILARWEB_MAX_RESPONSE_BYTES:
+        raise SimilarWebResponseTooLarge(f"Response of {content_length} bytes exceeds the {SIMILARWEB_MAX_RESPONSE_BYTES} byte limit.")
+
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        size += len(chunk)
+        if size > SIMILARWEB_MAX_RESPONSE_BYTES:
+            raise SimilarWebResponseTooLarge(f"Response exceeds the {SIMILARWEB_MAX_RESPONSE_BYTES} byte limit.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def _similarweb_get(url, params):
+    """
+    GETs a SimilarWeb URL, retrying with backoff on rate limiting and transient server errors.
+    Returns the final response and its body, which is streamed and capped in size.
+    """
+    for attempt in range(SIMILARWEB_MAX_RETRIES + 1):
+        response = await similarweb_client.send(similarweb_client.build_request("GET", url, params=params), stream=True)
+        _mark_similarweb_used()
+        retry_after = response.headers.get("Retry-After", "")
+        # Don't stall the run waiting on a long Retry-After; report the error to the assistant instead
+        wait_too_long = retry_after.isdigit() and int(retry_after) > SIMILARWEB_RETRY_BACKOFF_CAP
+        if (response.status_code not in SIMILARWEB_RETRY_STATUSES
+                or attempt == SIMILARWEB_MAX_RETRIES or wait_too_long):
+            try:
+                return response, await _read_capped(response)
+            finally:
+                await response.aclose()
+
+        await response.aclose()
+        delay = float(retry_after) if retry_after.isdigit() else _backoff_delay(attempt)
+        logger.warning("SimilarWeb API returned %s, retrying in %.1fs...", response.status_code, delay)
+        await asyncio.sleep(delay)
+
+def _mark_similarweb_used():
+    """Records that the SimilarWeb pool just made a request, so its connection is warm."""
+    global similarweb_last_used
+    similarweb_last_used = time.monotonic()
+
+async def warm_up_similarweb():
+    """
+    Opens a pooled connection to SimilarWeb (DNS + TLS) so the next tool call doesn't pay for it.
+    Does nothing while a connection from a recent request is still within SIMILARWEB_KEEPALIVE_EXPIRY.
+    """
     if not similarweb_api_key:
-        print("Error: SimilarWeb API key not configured in the environment.")
-        return json.dumps({"error": "SimilarWeb API key not configured by the system administrator."})
-
-    base_url = "https://api.similarweb.com/v4/shopper/category-top-keywords"
-    params = {
-        "api_key": similarweb_api_key,
-        "category": category,
-        "domain": domain,
-        "start_date": start_date, # Format YYYY-MM
-        "end_date": end_date,     # Format YYYY-MM
-        "granularity": granularity,
-        "limit": limit,
-        "format": "json"
-    }
-    print(f"Calling SimilarWeb API with params: {params}") # Log params (excluding api_key for security if sensitive)
+        return
+    # Leave a margin so the connection doesn't expire between this check and the tool call
+    if similarweb_last_used is not None and time.monotonic() - similarweb_last_used < SIMILARWEB_KEEPALIVE_EXPIRY / 2:
+        return
+    try:
+        await similarweb_client.head("https://api.similarweb.com/", timeout=5)
+        _mark_similarweb_used()
+        logger.debug("SimilarWeb connection warmed up.")
+    except httpx.HTTPError as e:
+        logger.debug("SimilarWeb warm-up failed: %s", e)
+
+def _slim_similarweb_response(data, limit):
+    """
+    Keeps only the response fields the assistant uses, to cut tokens on the next model turn.
+    Items with none of SIMILARWEB_KEYWORD_FIELDS are passed through whole rather than emptied.
+    """
+    items = []
+    untrimmed = []
+    for item in data["data"][:limit]:
+        slim_item = {field: item[field] for field in SIMILARWEB_KEYWORD_FIELDS if field in item} if isinstance(item, dict) else None
+        if not slim_item:
+            untrimmed.append(item)
+            slim_item = item
+        items.append(slim_item)
+    if untrimmed:
+        logger.warning("%d SimilarWeb keyword item(s) had no known fields and were passed through untrimmed, e.g.: %.200s",
+                       len(untrimmed), untrimmed[0])
+    return {"meta": data.get("meta"), "data": items}
+
+async def _fetch_similarweb_top_keywords(category: str, domain: str, start_date: str, end_date: str, granularity: str, limit: int, verbose: bool):
+    """
+    Fetches top keywords from SimilarWeb API for a given category, domain, and date range.
+    Returns the JSON string for the assistant and whether that result may be cached.
+    """
+    if not similarweb_api_key:
+        logger.error("SimilarWeb API key not configured in the environment.")
+        return orjson.dumps({"error": "SimilarWeb API key not configured by the system administrator."}).decode(), False
+
+    params = (
+        *SIMILARWEB_BASE_PARAMS,
+        ("category", category),
+        ("domain", domain),
+        ("start_date", start_date), # Format YYYY-MM
+        ("end_date", end_date),     # Format YYYY-MM
+        ("granularity", granularity),
+        ("limit", limit)
+    )
+    logger.debug("Calling SimilarWeb API: category=%s domain=%s dates=%s..%s granularity=%s limit=%s",
+                 category, domain, start_date, end_date, granularity, limit) # Never log the api_key
     
     try:
-        response = requests.get(base_url, params=params)
-        print(f"SimilarWeb API raw response status: {response.status_code}")
+        response, body = await _similarweb_get(SIMILARWEB_TOP_KEYWORDS_URL, params)
+        logger.debug("SimilarWeb API raw response status: %s", response.status_code)
         response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
         
-        data = response.json()
-        print(f"SimilarWeb API JSON response snippet: {str(data)[:500]}...")
+        data = orjson.loads(body)
+        logger.debug("SimilarWeb API JSON response snippet: %.500s...", data)
 
         if not data.get("data") and data.get("meta", {}).get("status") == "Success":
             # API call was successful but returned no specific keyword data (e.g., for a very niche query)
-            print("SimilarWeb API returned success but no data items.")
-            return json.dumps({"message": "The API query was successful but returned no keyword data for the specified parameters. This might indicate no significant keywords were found."})
+            logger.info("SimilarWeb API returned success but no data items.")
+            return orjson.dumps({"message": "The API query was successful but returned no keyword data for the specified parameters. This might indicate no significant keywords were found."}).decode(), True
         elif not data.get("data"):
-            print(f"SimilarWeb API returned no data items. Full response: {data}")
-            return json.dumps({"error": "API returned no keyword data.", "details": data})
+            logger.warning("SimilarWeb API returned no data items. Full response: %s", data)
+            return orjson.dumps({"error": "API returned no keyword data.", "details": data}).decode(), False
             
-        return data # Return the full JSON response dictionary for the assistant to process
+        if not verbose:
+            data = _slim_similarweb_response(data, limit)
+        return orjson.dumps(data).decode(), True
 
-    except requests.exceptions.HTTPError as http_err:
-        error_message = f"HTTP error occurred: {http_err.response.status_code} - {http_err.response.reason}."
-        details = {"status_code": http_err.response.status_code, "reason": http_err.response.reason}
+    except httpx.HTTPStatusError as http_err:
+        error_message = f"HTTP error occurred: {http_err.response.status_code} - {http_err.response.reason_phrase}."
+        details = {"status_code": http_err.response.status_code, "reason": http_err.response.reason_phrase}
         try:
-            error_details_from_api = http_err.response.json()
+            error_details_from_api = orjson.loads(body)
             details["api_error"] = error_details_from_api
-            print(f"SimilarWeb API HTTP error details: {error_details_from_api}")
-        except json.JSONDecodeError:
-            details["raw_response_text"] = http_err.response.text
-            print(f"SimilarWeb API HTTP error (non-JSON response): {http_err.response.text}")
-        print(f"Error calling SimilarWeb API: {error_message}")
-        return json.dumps({"error": error_message, "details": details})
+            logger.warning("SimilarWeb API HTTP error details: %s", error_details_from_api)
+        except orjson.JSONDecodeError:
+            details["raw_response_text"] = body.decode(errors="replace")
+            logger.warning("SimilarWeb API HTTP error (non-JSON response): %s", details["raw_response_text"])
+        logger.error("Error calling SimilarWeb API: %s", error_message)
+        return orjson.dumps({"error": error_message, "details": details}).decode(), False
         
-    except requests.exceptions.RequestException as req_err:
-        print(f"Error calling SimilarWeb API (RequestException): {req_err}")
-        return json.dumps({"error": f"A network request error occurred: {str(req_err)}"})
+    except httpx.RequestError as req_err:
+        logger.error("Error calling SimilarWeb API (RequestError): %s", req_err)
+        return orjson.dumps({"error": f"A network request error occurred: {str(req_err)}"}).decode(), False
         
-    except json.JSONDecodeError as json_err:
-        print(f"Error decoding JSON from SimilarWeb API. Raw response: {response.text[:500]}... Error: {json_err}")
-        return json.dumps({"error": "Invalid JSON response from SimilarWeb API. The API did not return valid JSON.", "details": {"raw_response_preview": response.text[:500]}})
+    except SimilarWebResponseTooLarge as size_err:
+        logger.error("SimilarWeb API response too large: %s", size_err)
+        return orjson.dumps({"error": "SimilarWeb API response was too large to process. Try a smaller limit or date range."}).decode(), False
+
+    except orjson.JSONDecodeError as json_err:
+        raw_preview = body[:500].decode(errors="replace")
+        logger.error("Error decoding JSON from SimilarWeb API. Raw response: %s... Error: %s", raw_preview, json_err)
+        return orjson.dumps({"error": "Invalid JSON response from SimilarWeb API. The API did not return valid JSON.", "details": {"raw_response_preview": raw_preview}}).decode(), False
     
     except Exception as e: # Catch-all for other unexpected errors
-        print(f"An unexpected error occurred in get_similarweb_top_keywords: {e}")
-        return json.dumps({"error": f"An unexpected error occurred while fetching data: {str(e)}"})
+        logger.exception("An unexpected error occurred in get_similarweb_top_keywords: %s", e)
+        return orjson.dumps({"error": f"An unexpected error occurred while fetching data: {str(e)}"}).decode(), False
+
+async def get_similarweb_top_keywords(category: str, domain: str, start_date: str, end_date: str, granularity: str = "Monthly", limit: int = 10, verbose: bool = False):
+    """
+    Returns top keywords from SimilarWeb for a given category, domain, and date range as a JSON string.
+    Only the keyword fields in SIMILARWEB_KEYWORD_FIELDS are kept unless verbose is set.
+    Successful responses are cached, so repeating a query within the TTL skips the API call.
+    """
+    # Normalize the arguments so trivially different spellings of a query share a cache entry
+    key = (str(category).strip(), str(domain).strip().lower(), str(start_date).strip(),
+           str(end_date).strip(), str(granularity).strip(), int(limit), bool(verbose))
+
+    # No lock needed: the event loop never switches tasks between this lookup and the store below
+    cached = similarweb_cache.get(key)
+    if cached is not None:
+        similarweb_cache_stats["hits"] += 1
+        logger.debug("SimilarWeb cache hit for %s", key)
+        return cached
+    similarweb_cache_stats["misses"] += 1
+
+    output, cacheable = await _fetch_similarweb_top_keywords(*key)
+    if cacheable:
+        similarweb_cache[key] = output
+    return output
+
+def similarweb_cache_info():
+    """Returns hit/miss counters and current size of the SimilarWeb response cache."""
+    return {**similarweb_cache_stats, "size": similarweb_cache.currsize, "maxsize": similarweb_cache.maxsize, "ttl": similarweb_cache.ttl}
 
 # --- OpenAI Assistant Core Functions (Modified where necessary) ---
 
-def create_thread():
+# Run events after which no further events are streamed for the run.
+TERMINAL_RUN_EVENTS = (
+    "thread.run.completed",
+    "thread.run.incomplete",
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+)
+
+async def create_thread():
     """
     Creates a new conversation thread.
     """
     try:
-        thread = client.beta.threads.create()
-        print(f"Thread created with ID: {thread.id}")
+        thread = await client.beta.threads.create()
+        logger.info("Thread created with ID: %s", thread.id)
         return thread
     except Exception as e:
-        print(f"Error creating thread: {e}")
+        logger.error("Error creating thread: %s", e)
         return None
 
-def add_message_to_thread(thread_id, content, role="user"):
+async def add_message_to_thread(thread_id, content, role="user"):
     """
     Adds a message to a specific thread.
     """
     try:
-        message = client.beta.threads.messages.create(
+        message = await client.beta.threads.messages.create(
             thread_id=thread_id,
             role=role,
             content=content
         )
-        print(f"Message added to thread {thread_id}.")
+        logger.debug("Message added to thread %s.", thread_id)
         return message
     except Exception as e:
-        print(f"Error adding message to thread: {e}")
+        logger.error("Error adding message to thread: %s", e)
         return None
 
-def run_assistant(thread_id, assistant_id, instructions="Please address the user's request."):
+async def handle_tool_call(tool_call):
     """
-    Runs the assistant on a specific thread.
+    Dispatches a single tool call requested by the assistant and returns its output as a string.
+    """
+    function_name = tool_call.function.name
+    arguments = tool_call.function.arguments
+
+    logger.info("Assistant wants to call function: %s with arguments: %s", function_name, arguments)
+
+    if function_name == "get_similarweb_top_keywords":
+        # Validate straight from the raw JSON; defaults for granularity and limit come from the model
+        try:
+            args = SimilarWebArgs.model_validate_json(arguments)
+        except ValidationError as e:
+            logger.warning("Invalid arguments for %s: %s", function_name, e)
+            # Return the structured errors so the assistant can correct its call
+            return orjson.dumps({
+                "error": "Invalid arguments for get_similarweb_top_keywords.",
+                "details": e.errors(include_url=False, include_context=False)
+            }).decode()
+
+        return await get_similarweb_top_keywords(**args.model_dump())
+
+    logger.warning("Unknown function call: %s", function_name)
+    return orjson.dumps({"error": f"Function {function_name} not found."}).decode()
+
+class RunEventHandler(AsyncAssistantEventHandler):
+    """
+    Handles server-sent events for a run: dispatches tool calls when the run
+    requires action, keeps the text of the latest completed assistant message,
+    and records the run once it reaches a terminal status.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.final_run = None
+        self.response_text = None
+
+    @override
+    async def on_event(self, event):
+        if event.event == "thread.run.requires_action":
+            await self.handle_requires_action(event.data)
+        elif event.event == "thread.message.completed":
+            # Assuming the response is in the first content block and is text.
+            message = event.data
+            if message.role == "assistant" and message.content and message.content[0].type == "text":
+                self.response_text = message.content[0].text.value
+        elif event.event in TERMINAL_RUN_EVENTS:
+            logger.debug("Run status: %s", event.data.status)
+            self.final_run = event.data
+
+    async def handle_requires_action(self, run):
+        """Runs the requested tools and continues the run on a new event stream."""
+        if not (run.required_action and run.required_action.type == "submit_tool_outputs"):
+            return
+
+        # Run all requested tools concurrently; outputs are still submitted as one batch
+        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+        outputs = await asyncio.gather(*(handle_tool_call(tool_call) for tool_call in tool_calls))
+        tool_outputs = [
+            {"tool_call_id": tool_call.id, "output": output}
+            for tool_call, output in zip(tool_calls, outputs)
+        ]
+
+        # Submit tool outputs back to the assistant; the rest of the run is streamed to a child handler
+        handler = RunEventHandler()
+        async with client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=run.thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+            event_handler=handler
+        ) as stream:
+            logger.debug("Tool outputs submitted.")
+            await stream.until_done()
+        self.final_run = handler.final_run
+        if handler.response_text is not None:
+            self.response_text = handler.response_text
+
+async def run_assistant(thread_id, assistant_id, instructions="Please address the user's request."):
+    """
+    Runs the assistant on a specific thread, streaming run events until the run ends.
+    Tool calls are handled as they arrive. Returns the final run (None on failure) and
+    the text of the assistant's reply if one was streamed.
     """
     try:
-        run = client.beta.threads.runs.create(
+        handler = RunEventHandler()
+        async with client.beta.threads.runs.stream(
             thread_id=thread_id,
             assistant_id=assistant_id,
-            instructions=instructions
-        )
-        print(f"Run created with ID: {run.id} for thread {thread_id} with assistant {assistant_id}")
-        return run
+            instructions=instructions,
+            event_handler=handler
+        ) as stream:
+            logger.debug("Run streaming for thread %s with assistant %s", thread_id, assistant_id)
+            await stream.until_done()
     except Exception as e:
-        print(f"Error running assistant: {e}")
-        return None
+        logger.error("Error running assistant: %s", e)
+        return None, None
 
-def check_run_status(thread_id, run_id, polling_interval=3):
-    """ 
-    Checks the status of a run, handles actions if required, and waits for completion.
-    """
-    try:
-        while True:
-            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
-            print(f"Run status: {run.status}")
-
-            if run.status == "completed":
-                return run
-            elif run.status == "requires_action":
-                if run.required_action and run.required_action.type == "submit_tool_outputs":
-                    tool_calls = run.required_action.submit_tool_outputs.tool_calls
-                    tool_outputs = []
-
-                    for tool_call in tool_calls:
-                        function_name = tool_call.function.name
-                        arguments = json.loads(tool_call.function.arguments)
-                        output = None
-
-                        print(f"Assistant wants to call function: {function_name} with arguments: {arguments}")
-
-                        if function_name == "get_similarweb_top_keywords":
-                            # Ensure all required arguments are present, provide defaults from schema if applicable
-                            # The schema already defines defaults for granularity and limit, but we get them from assistant
-                            category_val = arguments.get("category")
-                            domain_val = arguments.get("domain")
-                            start_date_val = arguments.get("start_date")
-                            end_date_val = arguments.get("end_date")
-                            granularity_val = arguments.get("granularity", "Monthly") # Default from schema
-                            limit_val = arguments.get("limit", 10) # Default from schema
-                            
-                            if not all([category_val, domain_val, start_date_val, end_date_val]):
-                                output = json.dumps({"error": "Missing one or more required arguments: category, domain, start_date, end_date."})
-                            else:
-                                api_response = get_similarweb_top_keywords(
-                                    category=category_val,
-                                    domain=domain_val,
-                                    start_date=start_date_val,
-                                    end_date=end_date_val,
-                                    granularity=granularity_val,
-                                    limit=limit_val
-                                )
-                                # The API function already returns a JSON string or dict, ensure it's string for submission
-                                if isinstance(api_response, dict):
-                                    output = json.dumps(api_response)
-                                else:
-                                    output = api_response # Assuming it's already a JSON string
-                        else:
-                            print(f"Unknown function call: {function_name}")
-                            output = json.dumps({"error": f"Function {function_name} not found."})
-                        
-                        tool_outputs.append({
-                            "tool_call_id": tool_call.id,
-                            "output": output
-                        })
-                    
-                    # Submit tool outputs back to the assistant
-                    try:
-                        run = client.beta.threads.runs.submit_tool_outputs(
-                            thread_id=thread_id,
-                            run_id=run_id,
-                            tool_outputs=tool_outputs
-                        )
-                        print("Tool outputs submitted.")
-                    except Exception as e:
-                        print(f"Error submitting tool outputs: {e}")
-                        return None # Or handle more gracefully
-            elif run.status in ["queued", "in_progress"]:
-                time.sleep(polling_interval)
-            else: # failed, cancelled, expired
-                print(f"Run ended with status: {run.status}")
-                return None
-    except Exception as e:
-        print(f"Error checking run status: {e}")
-        return None
+    run = handler.final_run
+    if run and run.status != "completed":
+        logger.warning("Run ended with status: %s", run.status)
+    return run, handler.response_text
 
-def get_assistant_response(thread_id):
+async def get_assistant_response(thread_id):
     """
-    Retrieves the latest messages from the thread, filtering for assistant responses.
+    Retrieves the latest message from the thread if it is an assistant response.
+    Only needed when the reply was not captured from the run's event stream.
     """
     try:
-        messages = client.beta.threads.messages.list(thread_id=thread_id, order="desc")
+        messages = await client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
         # The API returns messages in descending order. The first assistant message is the latest response.
         for msg in messages.data:
             if msg.role == "assistant":
@@ -263,88 +482,264 @@ def get_assistant_response(thread_id):
                     return msg.content[0].text.value
         return "No assistant response found."
     except Exception as e:
-        print(f"Error retrieving assistant response: {e}")
+        logger.error("Error retrieving assistant response: %s", e)
         return "Error fetching response."
 
-def update_assistant_with_tools(assistant_id, tools_list):
+async def assistant_has_tools(assistant_id, tool_signatures):
+    """Checks whether an existing assistant already has every tool in tool_signatures (see _tool_signature)."""
+    try:
+        assistant = await client.beta.assistants.retrieve(assistant_id)
+    except Exception as e:
+        logger.error("Error retrieving assistant %s: %s", assistant_id, e)
+        return False
+    have = {_tool_signature(tool.model_dump(exclude_none=True)) for tool in assistant.tools}
+    return all(signature in have for signature in tool_signatures)
+
+def _read_assistant_cache():
+    """Reads the local assistant cache, treating a missing or corrupt file as empty."""
+    try:
+        with open(ASSISTANT_CACHE_FILE, "rb") as f:
+            cache = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def load_synced_tools_hash(assistant_id):
+    """Returns the tool definition hash last synced to the assistant, or None if unknown."""
+    return _read_assistant_cache().get(assistant_id)
+
+def save_synced_tools_hash(assistant_id, tools_hash):
+    """Records the tool definition hash that the assistant now has."""
+    cache = _read_assistant_cache()
+    cache[assistant_id] = tools_hash
+    try:
+        with open(ASSISTANT_CACHE_FILE, "wb") as f:
+            f.write(orjson.dumps(cache))
+    except OSError as e:
+        logger.warning("Could not write assistant cache %s: %s", ASSISTANT_CACHE_FILE, e)
+
+async def update_assistant_with_tools(assistant_id, tools_list):
     """Updates an existing assistant with new tools."""
     try:
-        assistant = client.beta.assistants.update(
+        assistant = await client.beta.assistants.update(
             assistant_id=assistant_id,
             tools=tools_list
         )
-        print(f"Assistant {assistant_id} updated successfully with tools.")
+        logger.info("Assistant %s updated successfully with tools.", assistant_id)
         return assistant
     except Exception as e:
-        print(f"Error updating assistant {assistant_id}: {e}")
+        logger.error("Error updating assistant %s: %s", assistant_id, e)
         return None
 
-def main():
+# --- Semantic Response Cache ---
+
+# Replies to earlier questions, keyed by the question's embedding. A new question is answered
+# without a run only if it is nearly identical in meaning to a cached one AND mentions exactly
+# the same query terms (domains, dates, months, granularity, counts), since embeddings barely
+# distinguish "amazon.com" from "ebay.com", July from August, or weekly from monthly.
+# Only self-contained questions, which name a domain, are cached: follow-ups such as
+# "what about weekly instead?" depend on the conversation and must always go to the assistant.
+SEMANTIC_CACHE_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.97
+QUESTION_DOMAIN_PATTERN = r"[a-z0-9-]+(?:\.[a-z0-9-]+)+"
+QUESTION_ENTITY_PATTERN = re.compile(
+    QUESTION_DOMAIN_PATTERN  # amazon.com
+    + r"|\d+"  # YYYY-MM dates, limits and category IDs
+    + r"|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    + r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+    + r"|\b(?:daily|weekly|monthly|day|week|month|quarter|year|last|this|next|previous|current)\b"
+    + r"|\b(?:one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|fifteen|twenty"
+    + r"|thirty|forty|fifty|hundred|dozen)\b"
+)
+semantic_cache_vectors = None # (n, dim) matrix of unit-length embeddings
+semantic_cache_entities = []
+semantic_cache_responses = []
+
+def _question_entities(question):
     """
-    Main function to demonstrate the OpenAI assistant interaction with function calling.
-    Allows for continuous interaction until the user types 'quit' or 'exit'.
+    Returns the query terms mentioned in a question, in order, or None if the question
+    names no domain and so may depend on earlier turns.
     """
-    print("Starting AI Assistant interaction with function calling...")
-    print("Type 'quit' or 'exit' to end the conversation.")
-
-    assistant_id = "asst_djvGrAsDkIoftYlIVUKoBgTq" # Your existing assistant ID
-    print(f"Using existing assistant with ID: {assistant_id}")
-
-    # Update the assistant to be aware of the new tool
-    # This only needs to be done once per assistant configuration change.
-    # For simplicity in this script, it's done at the start.
-    # In a production scenario, you might manage assistant versions or update them less frequently.
-    print("Updating assistant with the latest tool definitions...")
-    updated_assistant = update_assistant_with_tools(assistant_id, [similarweb_tool_definition])
-    if not updated_assistant:
-        print("Failed to update assistant with tools. Functionality might be limited. Exiting.")
-        return
-    print("Assistant updated.")
-
-    thread = create_thread()
-    if not thread:
-        print("Exiting due to thread creation failure.")
-        return
-    print(f"New conversation started on Thread ID: {thread.id}")
-
-    while True:
-        try:
-            user_question = input("\nYou: ")
-        except EOFError:
-            print("\nExiting conversation (EOF received).")
-            break # Gracefully exit if input stream is closed (e.g. piping input)
-        
-        if user_question.lower() in ["quit", "exit"]:
-            print("Exiting conversation.")
-            break
-
-        if not user_question.strip():
-            print("No input received, please type a message or 'quit'/'exit'.")
-            continue
+    entities = tuple(QUESTION_ENTITY_PATTERN.findall(question.lower()))
+    if not any(re.fullmatch(QUESTION_DOMAIN_PATTERN, entity) for entity in entities):
+        return None
+    return entities
 
-        print(f"Adding message to thread {thread.id}...")
-        if not add_message_to_thread(thread.id, user_question):
-            print("Failed to add message. Please try again.")
-            continue
+def is_cacheable_question(question):
+    """Whether a question is self-contained enough to be answered from, or stored in, the semantic cache."""
+    return _question_entities(question) is not None
 
-        print(f"Running assistant {assistant_id} on thread {thread.id}...")
-        run = run_assistant(thread.id, assistant_id,
-                            instructions="Please use available tools if a user asks for keyword information. Address the user directly.")
-        if not run:
-            print("Failed to start assistant run. Please try again.")
-            continue
+async def embed_question(question):
+    """Returns the unit-length embedding of a question, or None if it could not be computed."""
+    try:
+        result = await client.embeddings.create(model=SEMANTIC_CACHE_MODEL, input=question)
+    except Exception as e:
+        logger.error("Error embedding question: %s", e)
+        return None
+    vector = np.asarray(result.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
 
-        completed_run = check_run_status(thread.id, run.id)
-        if not completed_run or completed_run.status != "completed":
-            print("Assistant run did not complete successfully. Please try again or check logs.")
-            # Potentially retrieve partial messages or more detailed error here if needed
-            continue
+def lookup_semantic_cache(vector, question):
+    """Returns the cached reply for the most similar earlier question about the same entities, if any."""
+    entities = _question_entities(question)
+    if semantic_cache_vectors is None or entities is None:
+        return None
+    similarities = semantic_cache_vectors @ vector # Dot product of unit vectors is cosine similarity
+    for index in np.argsort(similarities)[::-1]:
+        if similarities[index] < SEMANTIC_CACHE_THRESHOLD:
+            break
+        if semantic_cache_entities[index] == entities:
+            logger.debug("Semantic cache hit with similarity %.3f", similarities[index])
+            return semantic_cache_responses[index]
+    return None
+
+def store_semantic_cache(vector, question, response):
+    """Adds a question embedding and the assistant's reply to the semantic cache, if the question is cacheable."""
+    global semantic_cache_vectors
+    entities = _question_entities(question)
+    if entities is None:
+        return
+    if semantic_cache_vectors is None:
+        semantic_cache_vectors = vector[np.newaxis, :]
+    else:
+        semantic_cache_vectors = np.vstack([semantic_cache_vectors, vector])
+    semantic_cache_entities.append(entities)
+    semantic_cache_responses.append(response)
+
+def clear_semantic_cache():
+    """Drops every cached reply."""
+    global semantic_cache_vectors
+    semantic_cache_vectors = None
+    semantic_cache_entities.clear()
+    semantic_cache_responses.clear()
+
+async def main():
+    """
+    Main function to demonstrate the OpenAI assistant interaction with function calling.
+    Allows for continuous interaction until the user types 'quit' or 'exit'.
+    """
+    # Diagnostics go through logging; set LOG_LEVEL=DEBUG to see API and run details.
+    # The level applies to this module's logger only: third-party loggers stay at WARNING,
+    # since httpx logs request URLs at INFO and those include the SimilarWeb api_key.
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    log_level = os.getenv("LOG_LEVEL", "WARNING").upper()
+    if isinstance(logging.getLevelName(log_level), int):
+        logger.setLevel(log_level)
+    else:
+        logger.warning("Unknown LOG_LEVEL %r, using WARNING.", log_level)
+    for noisy_logger in ("httpx", "httpcore"):
+        logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+    # Prime the SimilarWeb connection in the background while the assistant and thread are set up.
+    # OpenAI needs no warm-up: the startup calls below already open its connection before the first prompt.
+    warmup_task = asyncio.create_task(warm_up_similarweb())
 
-        print("Retrieving assistant's response...")
-        response = get_assistant_response(thread.id)
-        print(f"\nAssistant: {response}")
+    try:
+        print("Starting AI Assistant interaction with function calling...")
+        print("Type 'quit' or 'exit' to end the conversation, or '/cache' to show SimilarWeb cache statistics.")
+        print("Prefix a message with '/fresh' to clear cached answers and ask the assistant again.")
+
+        assistant_id = "asst_djvGrAsDkIoftYlIVUKoBgTq" # Your existing assistant ID
+        print(f"Using existing assistant with ID: {assistant_id}")
+
+        # Update the assistant to be aware of the new tool
+        # This only needs to be done once per assistant configuration change, so skip it when
+        # a previous run already synced this definition or the assistant already has it.
+        if load_synced_tools_hash(assistant_id) == SIMILARWEB_TOOL_HASH:
+            print("Assistant tool definitions unchanged since last run.")
+        elif await assistant_has_tools(assistant_id, [SIMILARWEB_TOOL_BYTES]):
+            print("Assistant already has the latest tool definitions.")
+            save_synced_tools_hash(assistant_id, SIMILARWEB_TOOL_HASH)
+        else:
+            print("Updating assistant with the latest tool definitions...")
+            updated_assistant = await update_assistant_with_tools(assistant_id, [similarweb_tool_definition])
+            if not updated_assistant:
+                print("Failed to update assistant with tools. Functionality might be limited. Exiting.")
+                return
+            save_synced_tools_hash(assistant_id, SIMILARWEB_TOOL_HASH)
+            print("Assistant updated.")
+
+        thread = await create_thread()
+        if not thread:
+            print("Exiting due to thread creation failure.")
+            return
+        print(f"New conversation started on Thread ID: {thread.id}")
+
+        # prompt_async waits on the event loop, so background tasks keep running at the prompt;
+        # the session also provides line editing and persistent history.
+        prompt_session = PromptSession(history=FileHistory(HISTORY_FILE))
 
-    print("\nConversation finished.")
+        while True:
+            try:
+                user_question = await prompt_session.prompt_async("\nYou: ")
+            except EOFError:
+                print("\nExiting conversation (EOF received).")
+                break # Gracefully exit if input stream is closed (e.g. piping input)
+        
+            if user_question.lower() in ["quit", "exit"]:
+                print("Exiting conversation.")
+                break
+
+            if not user_question.strip():
+                print("No input received, please type a message or 'quit'/'exit'.")
+                continue
+
+            if user_question.strip() == "/cache":
+                print(f"SimilarWeb cache: {similarweb_cache_info()}")
+                continue
+
+            fresh = user_question.strip() == "/fresh" or user_question.startswith("/fresh ")
+            if fresh:
+                clear_semantic_cache()
+                user_question = user_question.strip()[len("/fresh"):].strip()
+                if not user_question:
+                    print("Cached answers cleared.")
+                    continue
+
+            # Answer repeated or rephrased questions from the semantic cache, skipping the run entirely.
+            # Follow-ups that don't name a domain are neither looked up nor stored, so don't embed them.
+            question_vector = await embed_question(user_question) if is_cacheable_question(user_question) else None
+            if question_vector is not None and not fresh:
+                cached_response = lookup_semantic_cache(question_vector, user_question)
+                if cached_response is not None:
+                    # Record the exchange in the thread so follow-up questions have its context
+                    if not (await add_message_to_thread(thread.id, user_question)
+                            and await add_message_to_thread(thread.id, cached_response, role="assistant")):
+                        print("Failed to add message. Please try again.")
+                        continue
+                    print(f"\nAssistant (cached): {cached_response}")
+                    continue
+
+            # The user may have idled past the keep-alive window; re-prime the pool while the run starts
+            warmup_task = asyncio.create_task(warm_up_similarweb())
+
+            logger.info("Adding message to thread %s...", thread.id)
+            if not await add_message_to_thread(thread.id, user_question):
+                print("Failed to add message. Please try again.")
+                continue
+
+            logger.info("Running assistant %s on thread %s...", assistant_id, thread.id)
+            completed_run, response = await run_assistant(thread.id, assistant_id,
+                                                          instructions="Please use available tools if a user asks for keyword information. Address the user directly.")
+            if not completed_run or completed_run.status != "completed":
+                print("Assistant run did not complete successfully. Please try again or check logs.")
+                # Potentially retrieve partial messages or more detailed error here if needed
+                continue
+
+            if response is None:
+                logger.info("Retrieving assistant's response...")
+                response = await get_assistant_response(thread.id)
+            elif question_vector is not None:
+                # Only replies captured from the run are cached; the fallback may return an error message
+                store_semantic_cache(question_vector, user_question, response)
+            print(f"\nAssistant: {response}")
+
+        print("\nConversation finished.")
+    finally:
+        # Runs on every exit path, including the early returns during startup
+        warmup_task.cancel()
+        await similarweb_client.aclose()
+        await client.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file